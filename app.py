@@ -4,15 +4,33 @@ Flask Web API for NY SLA Japanese Restaurant Agent - Debug Version
 All functionality in one file with comprehensive debugging.
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, request, stream_with_context
+from flask_compress import Compress
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import json
+from functools import lru_cache
+import re
+import orjson
+import threading
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import List, Dict, Optional
 import logging
 
 app = Flask(__name__)
 
+# Compress JSON responses, including the streamed /search and /search/county
+# bodies; the payloads are highly repetitive and shrink by roughly 10x.
+# flask-compress leaves gzip out of its streaming defaults, so list it here.
+app.config['COMPRESS_ALGORITHM'] = ['gzip', 'deflate']
+app.config['COMPRESS_ALGORITHM_STREAMING'] = ['gzip', 'deflate']
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_MIN_SIZE'] = 1024
+Compress(app)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,69 +51,227 @@ RESTAURANT_TYPES = [
     'On Premises Liquor', 'Wine, Beer, Cider'
 ]
 
-def fetch_licenses(limit=10000, county=None, use_active=False):
-    """Fetch licenses from NY SLA API with debugging"""
+# Record fields searched for Japanese keywords. Locally a missing field is just
+# empty text; the SoQL $where clause only uses the fields a dataset actually
+# has (see dataset_fields), since Socrata rejects queries on unknown columns.
+_FIELDS = ('premises_name', 'doing_business_as_name', 'trade_name')
+# Record fields returned by the search endpoints; SLA rows carry dozens more
+_KEEP = (
+    'premises_name', 'doing_business_as_name', 'trade_name',
+    'license_type_description', 'county', 'filing_date',
+    'zip_code', 'premises_address'
+)
+_JP_LOWER = tuple(k.lower() for k in JAPANESE_KEYWORDS)
+_RT_LOWER = tuple(t.lower() for t in RESTAURANT_TYPES)
+
+# Compile each keyword list into a single alternation so a record is scanned
+# once by the C regex engine instead of once per keyword. Plain substring
+# semantics are kept on purpose (e.g. 'sushi' matches 'Sushiya'). Text is
+# lower-cased once before matching, so the patterns need no IGNORECASE.
+JP_RE = re.compile('|'.join(re.escape(k) for k in _JP_LOWER))
+RT_RE = re.compile('|'.join(re.escape(t) for t in _RT_LOWER))
+
+# Shared HTTP session so repeated calls to data.ny.gov reuse keep-alive
+# connections instead of paying a TCP+TLS handshake on every request.
+# Worst case for one fetch: 4 attempts, at most 2 of them read timeouts, so
+# 2*20s + 2*5s + ~2s backoff = ~52s. Retry-After is ignored so a 429 cannot
+# stretch that. This must stay under the Gunicorn worker timeout.
+FETCH_TIMEOUT = (5, 20)  # (connect, read) seconds
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, read=1, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      respect_retry_after_header=False)
+))
+
+# SLA data only changes every few hours, so keep Japanese-name API responses
+# in memory for 15 minutes. Only japanese_only fetches are cached: unfiltered
+# /debug fetches are sized by the caller's limit and would let anyone pin
+# whole datasets. The cache is bounded by total rows, and it exists once per
+# Gunicorn worker. Cached lists are shared between requests: never mutate them.
+CACHE_TTL = 900
+CACHE_MAX_ROWS = 20000
+_license_cache = TTLCache(maxsize=CACHE_MAX_ROWS, ttl=CACHE_TTL, getsizeof=len)
+_license_cache_lock = threading.Lock()
+
+# Fetches currently in progress, keyed like the cache. Concurrent requests for
+# the same data wait on the first caller's fetch instead of issuing their own,
+# for as long as it runs: with retries a fetch can take close to a minute (see
+# FETCH_TIMEOUT), and giving up earlier would stampede a slow upstream.
+# Waiters re-check every INFLIGHT_POLL seconds that the fetch is still live.
+_inflight_fetches = {}
+INFLIGHT_POLL = 30
+
+# Serialized /search/nyc responses keyed by use_active; the aggregate costs
+# five fetches and filters but changes as slowly as the underlying data
+_nyc_cache = TTLCache(maxsize=2, ttl=CACHE_TTL)
+
+# Column names per dataset URL, read once from the API
+_dataset_fields = {}
+
+def dataset_fields(api_url):
+    """Column names of an SLA dataset, from Socrata's X-SODA2-Fields header"""
+    with _license_cache_lock:
+        fields = _dataset_fields.get(api_url)
+    if fields is None:
+        r = SESSION.get(api_url, params={'$limit': 1}, timeout=FETCH_TIMEOUT)
+        r.raise_for_status()
+        header = r.headers.get('X-SODA2-Fields')
+        # Without the header nothing is pushed upstream; the local filter
+        # still returns the right rows, just from an unfiltered fetch
+        fields = frozenset(orjson.loads(header)) if header else frozenset()
+        with _license_cache_lock:
+            _dataset_fields[api_url] = fields
+    return fields
+
+def _japanese_where(fields):
+    """SoQL filter that lets data.ny.gov drop non-Japanese names before they
+    are sent to us; filter_japanese still rechecks every returned record"""
+    return ' OR '.join(
+        f"lower({field}) like '%{kw}%'"
+        for kw in _JP_LOWER
+        for field in _FIELDS
+        if field in fields
+    )
+
+def _license_cache_key(limit, county, use_active, japanese_only):
+    """Key under which fetch_licenses caches a successful response"""
+    api_url = ACTIVE_API if use_active else PENDING_API
+    return (api_url, county.upper() if county else None, limit, japanese_only)
+
+def fetch_licenses(limit=10000, county=None, use_active=False, japanese_only=False):
+    """Fetch licenses from NY SLA API, optionally pre-filtered to Japanese names"""
     api_url = ACTIVE_API if use_active else PENDING_API
     params = {'$limit': limit, '$order': 'filing_date DESC'}
     if county:
         params['county'] = county.upper()
     
-    logger.info(f"Fetching from {api_url} with params: {params}")
+    cache_key = _license_cache_key(limit, county, use_active, japanese_only)
+    cached = pending = done = None
+    if japanese_only:
+        with _license_cache_lock:
+            cached = _license_cache.get(cache_key)
+            pending = _inflight_fetches.get(cache_key) if cached is None else None
+            if cached is None and pending is None:
+                done = _inflight_fetches[cache_key] = threading.Event()
+    if cached is not None:
+        logger.debug("Cache hit for %s with params: %s", api_url, params)
+        return cached
+    
+    if pending is not None:
+        logger.debug("Waiting on in-flight fetch from %s with params: %s", api_url, params)
+        while not pending.wait(INFLIGHT_POLL):
+            with _license_cache_lock:
+                if _inflight_fetches.get(cache_key) is not pending:
+                    break
+        with _license_cache_lock:
+            cached = _license_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        # The shared fetch failed; fetch on our own below
+        done = None
+    
+    logger.info("Fetching from %s with params: %s", api_url, params)
     
     try:
-        r = requests.get(api_url, params=params, timeout=30)
+        if japanese_only:
+            where = _japanese_where(dataset_fields(api_url))
+            if where:
+                params['$where'] = where
+        r = SESSION.get(api_url, params=params, timeout=FETCH_TIMEOUT)
         r.raise_for_status()
-        data = r.json()
-        logger.info(f"Successfully fetched {len(data)} records from SLA API")
+        data = orjson.loads(r.content)
+        logger.info("Successfully fetched %d records from SLA API", len(data))
+        if japanese_only and len(data) <= CACHE_MAX_ROWS:
+            with _license_cache_lock:
+                _license_cache[cache_key] = data
         return data
     except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching from SLA API: {str(e)}")
+        logger.error("Error fetching from SLA API: %s", e)
         return []
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
+        logger.error("Unexpected error: %s", e)
         return []
+    finally:
+        if done is not None:
+            with _license_cache_lock:
+                _inflight_fetches.pop(cache_key, None)
+            done.set()
+
+def _search_text(record):
+    """Lower-cased text of the record fields searched for Japanese keywords"""
+    get = record.get
+    return ' '.join([str(get(f, '')) for f in _FIELDS]).lower()
 
 def is_japanese(record):
     """Check if record matches Japanese keywords"""
-    text = ' '.join([str(record.get(f, '')).lower() for f in 
-                     ['premises_name', 'doing_business_as_name', 'trade_name']])
-    matches = [kw for kw in JAPANESE_KEYWORDS if kw in text]
-    return len(matches) > 0, matches
+    matches = list(dict.fromkeys(JP_RE.findall(_search_text(record))))
+    return bool(matches), matches
 
 def is_restaurant(record):
     """Check if record is a restaurant type license"""
     lt = record.get('license_type_description', '').lower()
-    matches = [rt for rt in RESTAURANT_TYPES if rt.lower() in lt]
-    return len(matches) > 0, matches
+    matches = list(dict.fromkeys(RT_RE.findall(lt)))
+    return bool(matches), matches
+
+def is_japanese_fast(record):
+    """Boolean-only is_japanese that stops at the first keyword hit"""
+    return JP_RE.search(_search_text(record)) is not None
+
+@lru_cache(maxsize=256)
+def _is_restaurant_type(license_type):
+    """Memoized type check; SLA uses a small, closed set of license types"""
+    return RT_RE.search(license_type.lower()) is not None
+
+def is_restaurant_fast(record):
+    """Boolean-only is_restaurant that stops at the first type hit"""
+    return _is_restaurant_type(record.get('license_type_description', ''))
+
+def _project(record):
+    """Trim a record to the fields clients use, plus match details in debug mode"""
+    out = {k: record[k] for k in _KEEP if k in record}
+    if app.debug:
+        out['_debug_matched_keywords'] = is_japanese(record)[1]
+        out['_debug_matched_types'] = is_restaurant(record)[1]
+    return out
 
 def filter_japanese(records):
-    """Filter for Japanese restaurants with detailed logging"""
-    japanese_restaurants = []
-    restaurant_count = 0
-    japanese_count = 0
-    
-    for r in records:
-        is_rest, rest_matches = is_restaurant(r)
-        is_jap, jap_matches = is_japanese(r)
-        
-        if is_rest:
-            restaurant_count += 1
-        if is_jap:
-            japanese_count += 1
-            
-        if is_rest and is_jap:
-            r['_debug_matched_keywords'] = jap_matches
-            r['_debug_matched_types'] = rest_matches
-            japanese_restaurants.append(r)
+    """Filter for Japanese restaurants"""
+    # The license type check is cheap and rules out most records, so it runs
+    # first. Per-stage counts are available from /debug/stats.
+    japanese_restaurants = [
+        _project(r)
+        for r in records
+        if is_restaurant_fast(r) and is_japanese_fast(r)
+    ]
     
-    logger.info(f"Filtered {len(records)} records: {restaurant_count} restaurants, "
-                f"{japanese_count} Japanese, {len(japanese_restaurants)} Japanese restaurants")
+    logger.info("Filtered %d records: %d Japanese restaurants",
+                len(records), len(japanese_restaurants))
     
     return japanese_restaurants
 
+def json_response(obj, status=200):
+    """Serialize obj with orjson, which is much faster than the stdlib encoder"""
+    return Response(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS),
+                    status=status, mimetype='application/json')
+
+def stream_json(payload, key, items):
+    """Stream payload as a JSON object whose `key` array is written one item at a time"""
+    def generate():
+        head = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+        yield head[:-1] + (b',' if payload else b'') + orjson.dumps(key) + b':['
+        first = True
+        for item in items:
+            yield (b'' if first else b',') + orjson.dumps(item)
+            first = False
+        yield b']}'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 @app.route('/')
 def home():
-    return jsonify({
+    return json_response({
         'name': 'NY SLA Japanese Restaurant Tracker API',
         'version': '2.0.0-debug',
         'description': 'Monitor NY State Liquor Authority for new Japanese restaurant openings',
@@ -117,7 +293,7 @@ def home():
 
 @app.route('/health')
 def health():
-    return jsonify({
+    return json_response({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'service': 'ny-sla-japanese-restaurant-tracker',
@@ -127,7 +303,7 @@ def health():
 @app.route('/debug')
 def debug_info():
     """Comprehensive diagnostic endpoint"""
-    return jsonify({
+    return json_response({
         'endpoints': {
             'pending_api': PENDING_API,
             'active_api': ACTIVE_API
@@ -156,14 +332,15 @@ def debug_test_api():
     # Test pending API
     try:
         logger.info("Testing PENDING API connection...")
-        r = requests.get(f"{PENDING_API}?$limit=1", timeout=10)
+        r = SESSION.get(f"{PENDING_API}?$limit=1", timeout=10)
         r.raise_for_status()
+        data = orjson.loads(r.content)
         results['pending_api'] = {
             'status': 'success',
             'status_code': r.status_code,
             'url': PENDING_API,
-            'record_count': len(r.json()),
-            'sample': r.json()[0] if r.json() else None
+            'record_count': len(data),
+            'sample': data[0] if data else None
         }
     except Exception as e:
         results['pending_api'] = {
@@ -175,14 +352,15 @@ def debug_test_api():
     # Test active API
     try:
         logger.info("Testing ACTIVE API connection...")
-        r = requests.get(f"{ACTIVE_API}?$limit=1", timeout=10)
+        r = SESSION.get(f"{ACTIVE_API}?$limit=1", timeout=10)
         r.raise_for_status()
+        data = orjson.loads(r.content)
         results['active_api'] = {
             'status': 'success',
             'status_code': r.status_code,
             'url': ACTIVE_API,
-            'record_count': len(r.json()),
-            'sample': r.json()[0] if r.json() else None
+            'record_count': len(data),
+            'sample': data[0] if data else None
         }
     except Exception as e:
         results['active_api'] = {
@@ -191,7 +369,7 @@ def debug_test_api():
             'url': ACTIVE_API
         }
     
-    return jsonify(results)
+    return json_response(results)
 
 @app.route('/debug/sample')
 def debug_sample():
@@ -202,23 +380,24 @@ def debug_sample():
     
     records = fetch_licenses(limit=limit, county=county, use_active=use_active)
     
-    # Add debug info to each record
+    # Add debug info to a copy of each record (fetched records may be cached)
+    debug_records = []
     for r in records:
         is_rest, rest_matches = is_restaurant(r)
         is_jap, jap_matches = is_japanese(r)
-        r['_debug'] = {
+        debug_records.append(dict(r, _debug={
             'is_restaurant': is_rest,
             'restaurant_matches': rest_matches,
             'is_japanese': is_jap,
             'japanese_matches': jap_matches
-        }
+        }))
     
-    return jsonify({
+    return json_response({
         'success': True,
         'api_used': ACTIVE_API if use_active else PENDING_API,
         'county': county,
         'total_fetched': len(records),
-        'records': records
+        'records': debug_records
     })
 
 @app.route('/debug/stats')
@@ -262,7 +441,7 @@ def debug_stats():
     
     stats['sample_names'] = stats['sample_names'][:10]  # Limit to 10 samples
     
-    return jsonify({
+    return json_response({
         'success': True,
         'api_used': ACTIVE_API if use_active else PENDING_API,
         'county': county,
@@ -274,39 +453,38 @@ def search_all():
     try:
         limit = request.args.get('limit', 10000, type=int)
         use_active = request.args.get('active', 'false').lower() == 'true'
-        records = fetch_licenses(limit=limit, use_active=use_active)
+        records = fetch_licenses(limit=limit, use_active=use_active, japanese_only=True)
         restaurants = filter_japanese(records)
-        return jsonify({
+        return stream_json({
             'success': True,
             'count': len(restaurants),
             'total_records_fetched': len(records),
             'api_used': 'active' if use_active else 'pending',
-            'timestamp': datetime.now().isoformat(),
-            'restaurants': restaurants
-        })
+            'timestamp': datetime.now().isoformat()
+        }, 'restaurants', restaurants)
     except Exception as e:
-        logger.error(f"Search error: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        logger.error("Search error: %s", e)
+        return json_response({'success': False, 'error': str(e)}, 500)
 
 @app.route('/search/county/<county>')
 def search_county(county):
     try:
         limit = request.args.get('limit', 10000, type=int)
         use_active = request.args.get('active', 'false').lower() == 'true'
-        records = fetch_licenses(limit=limit, county=county, use_active=use_active)
+        records = fetch_licenses(limit=limit, county=county, use_active=use_active,
+                                 japanese_only=True)
         restaurants = filter_japanese(records)
-        return jsonify({
+        return stream_json({
             'success': True,
             'count': len(restaurants),
             'total_records_fetched': len(records),
             'county': county,
             'api_used': 'active' if use_active else 'pending',
-            'timestamp': datetime.now().isoformat(),
-            'restaurants': restaurants
-        })
+            'timestamp': datetime.now().isoformat()
+        }, 'restaurants', restaurants)
     except Exception as e:
-        logger.error(f"County search error: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        logger.error("County search error: %s", e)
+        return json_response({'success': False, 'error': str(e)}, 500)
 
 @app.route('/search/borough/<borough>')
 def search_borough(borough):
@@ -320,16 +498,21 @@ def search_borough(borough):
     }
     county = boroughs.get(borough.lower())
     if not county:
-        return jsonify({
+        return json_response({
             'success': False,
             'error': f'Unknown borough: {borough}. Use manhattan, brooklyn, queens, bronx, or staten-island'
-        }), 400
+        }, 400)
     return search_county(county)
 
 @app.route('/search/nyc')
 def search_nyc():
     try:
         use_active = request.args.get('active', 'false').lower() == 'true'
+        with _license_cache_lock:
+            body = _nyc_cache.get(use_active)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+        
         boroughs = {
             'Manhattan': 'New York',
             'Brooklyn': 'Kings',
@@ -339,8 +522,14 @@ def search_nyc():
         }
         summary = {}
         total = 0
-        for borough, county in boroughs.items():
-            records = fetch_licenses(county=county, limit=5000, use_active=use_active)
+        # Fetch all boroughs concurrently; each call is dominated by network latency
+        with ThreadPoolExecutor(max_workers=len(boroughs)) as executor:
+            fetched = executor.map(
+                lambda county: fetch_licenses(county=county, limit=5000, use_active=use_active,
+                                              japanese_only=True),
+                boroughs.values())
+            borough_records = dict(zip(boroughs, fetched))
+        for borough, records in borough_records.items():
             restaurants = filter_japanese(records)
             summary[borough] = {
                 'count': len(restaurants),
@@ -348,16 +537,23 @@ def search_nyc():
                 'restaurants': restaurants
             }
             total += len(restaurants)
-        return jsonify({
+        body = orjson.dumps({
             'success': True,
             'total_count': total,
             'api_used': 'active' if use_active else 'pending',
             'timestamp': datetime.now().isoformat(),
             'boroughs': summary
         })
+        # Failed fetches return [] and are never stored in the license cache,
+        # so only pin the aggregate when every borough's fetch is cached
+        with _license_cache_lock:
+            if all(_license_cache_key(5000, county, use_active, True) in _license_cache
+                   for county in boroughs.values()):
+                _nyc_cache[use_active] = body
+        return Response(body, mimetype='application/json')
     except Exception as e:
-        logger.error(f"NYC search error: {str(e)}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        logger.error("NYC search error: %s", e)
+        return json_response({'success': False, 'error': str(e)}, 500)
 
 if __name__ == '__main__':
     import os
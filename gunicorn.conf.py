@@ -0,0 +1,28 @@
+"""
+Gunicorn configuration for the NY SLA Japanese Restaurant Tracker API.
+Every request waits on data.ny.gov, so we run cooperative gevent workers
+to keep many upstream calls in flight at once.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Each worker holds its own response caches, so memory grows with the worker
+# count. cpu_count() reports the host's cores inside a container, so the
+# 2*CPU+1 default is capped; set WEB_CONCURRENCY to size it explicitly.
+MAX_DEFAULT_WORKERS = 4
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             min(multiprocessing.cpu_count() * 2 + 1, MAX_DEFAULT_WORKERS)))
+
+# The gevent worker monkey-patches the stdlib before loading app.py, so the
+# SLA API calls made through requests yield while waiting on the socket. Do
+# not enable preload_app: the app would be imported before patching.
+# Set GUNICORN_WORKER_CLASS=sync to fall back to an unpatched stdlib if
+# gevent misbehaves.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = 1000
+# Above the ~52s worst case of one SLA fetch with retries (FETCH_TIMEOUT in
+# app.py), plus filtering and serialization
+timeout = 90